@@ -1,26 +1,31 @@
-from flask import Flask, request, jsonify
-from flask_cors import CORS
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Route
+from contextlib import asynccontextmanager
+from typing import List
+from pydantic import BaseModel, Field, ValidationError, field_validator
 from dotenv import load_dotenv
 import os
-import google.generativeai as genai
+import httpx
 from datetime import datetime
 import logging
-import json
+import orjson
+import ijson
+import hashlib
+import re
+import asyncio
+import time
+from functools import lru_cache
+from cachetools import TTLCache
+import redis.asyncio as aioredis
+from redis.exceptions import RedisError
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
-# Update CORS settings to allow requests from frontend
-CORS(app, resources={
-    r"/api/*": {
-        "origins": ["http://localhost:3000", "http://127.0.0.1:3000"],
-        "methods": ["GET", "POST", "OPTIONS"],
-        "allow_headers": ["Content-Type", "Accept"]
-    }
-})
-
 # Load environment variables
 load_dotenv()
 
@@ -35,180 +40,494 @@ else:
     logger.error("Google API key not found in environment variables")
     raise ValueError("Google API key not found in environment variables")
 
-# Configure Gemini
-genai.configure(api_key=api_key)
-
-try:
-    # List available models
-    models = genai.list_models()
-    logger.info("Available models:")
-    for m in models:
-        logger.info(f"- {m.name}")
-    
-    # Use the correct model
-    model = genai.GenerativeModel('gemini-1.5-pro')
-    logger.info("Model initialized successfully with gemini-1.5-pro")
-except Exception as e:
-    logger.error(f"Error initializing model: {str(e)}")
-    raise
-
-@app.route('/api/health', methods=['GET'])
-def health_check():
+# Debug tracebacks and auto-reload are only enabled for local development
+DEBUG = os.getenv('APP_ENV', 'production') == 'development'
+
+# Configure Gemini REST access; one pooled client is shared by all requests
+GEMINI_API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+GEMINI_MODEL = "gemini-1.5-pro"
+GENERATE_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:generateContent"
+STREAM_URL = f"{GEMINI_API_BASE}/models/{GEMINI_MODEL}:streamGenerateContent?alt=sse"
+
+# Transient Gemini failures are retried with exponential backoff
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+RETRY_STATUSES = frozenset((429, 500, 502, 503, 504))
+
+# Keep-alive pool reuses TLS connections; the transport also retries failed connects
+client = httpx.AsyncClient(
+    headers={"x-goog-api-key": api_key},
+    timeout=httpx.Timeout(60.0, connect=10.0),
+    transport=httpx.AsyncHTTPTransport(
+        limits=httpx.Limits(max_keepalive_connections=16, max_connections=64, keepalive_expiry=75.0),
+        retries=MAX_RETRIES
+    )
+)
+
+async def check_model():
+    try:
+        # List available models
+        response = await client.get(f"{GEMINI_API_BASE}/models")
+        response.raise_for_status()
+        logger.info("Available models:")
+        for m in orjson.loads(response.content).get('models', []):
+            logger.info(f"- {m['name']}")
+        logger.info(f"Model initialized successfully with {GEMINI_MODEL}")
+    except Exception as e:
+        logger.error(f"Error initializing model: {str(e)}")
+        raise
+
+@asynccontextmanager
+async def lifespan(app):
+    await check_model()
+    worker = asyncio.create_task(batch_worker())
+    try:
+        yield
+    finally:
+        worker.cancel()
+        await client.aclose()
+        if redis_client is not None:
+            await redis_client.aclose()
+
+def gemini_request_body(prompt):
+    return orjson.dumps({
+        "contents": [{"parts": [{"text": prompt}]}],
+        "generationConfig": {"responseMimeType": "application/json"}
+    })
+
+def extract_text(data):
+    candidates = data.get('candidates') or []
+    if not candidates:
+        return ""
+    parts = candidates[0].get('content', {}).get('parts', [])
+    return "".join(part.get('text', '') for part in parts)
+
+@asynccontextmanager
+async def gemini_post(url, prompt):
+    body = gemini_request_body(prompt)
+    for attempt in range(MAX_RETRIES + 1):
+        request = client.build_request("POST", url, content=body, headers={"Content-Type": "application/json"})
+        response = await client.send(request, stream=True)
+        if response.status_code in RETRY_STATUSES and attempt < MAX_RETRIES:
+            await response.aclose()
+            delay = RETRY_BACKOFF * 2 ** attempt
+            logger.warning(f"Gemini returned {response.status_code}, retrying in {delay}s")
+            await asyncio.sleep(delay)
+            continue
+        try:
+            response.raise_for_status()
+            yield response
+        finally:
+            await response.aclose()
+        return
+
+async def generate_content(prompt):
+    async with gemini_post(GENERATE_URL, prompt) as response:
+        return extract_text(orjson.loads(await response.aread()))
+
+async def stream_plan(prompt, current_hour):
+    """Stream a schedule from Gemini, validating each activity as soon as it is parsed."""
+    items = ijson.sendable_list()
+    parser = ijson.items_coro(items, 'item', use_float=True)
+    chunks = []
+    head = ""
+    validated_plan = []
+    current_time = current_hour * 60  # Convert to minutes
+
+    async with gemini_post(STREAM_URL, prompt) as response:
+        async for line in response.aiter_lines():
+            if not line.startswith('data:'):
+                continue
+            text = extract_text(orjson.loads(line[5:]))
+            chunks.append(text)
+            if parser is None:
+                continue
+
+            # Skip anything the model emits before the array opens
+            if head is not None:
+                head += text
+                start = head.find('[')
+                if start < 0:
+                    continue
+                text, head = head[start:], None
+
+            try:
+                parser.send(text.encode())
+            except ijson.JSONError as e:
+                logger.warning(f"Incremental parsing failed, using buffered response: {str(e)}")
+                parser = None
+                continue
+
+            for item in items:
+                next_time = validate_activity(item, current_time)
+                if next_time is not None:
+                    validated_plan.append(item)
+                    current_time = next_time
+            del items[:]
+
+    if parser is not None:
+        try:
+            parser.close()
+        except ijson.JSONError as e:
+            logger.warning(f"Incremental parsing failed, using buffered response: {str(e)}")
+            parser = None
+
+    if parser is None:
+        return validate_plan(parse_json_array("".join(chunks)), current_hour)
+
+    logger.info(f"AI Response: {''.join(chunks)}")
+    if not validated_plan:
+        raise ValueError("No valid activities could be created")
+    return validated_plan
+
+# Cache validated plans so identical requests skip the Gemini round-trip
+PLAN_CACHE_TTL = 3600
+plan_cache = TTLCache(maxsize=1024, ttl=PLAN_CACHE_TTL)
+
+# Optional Redis cache shared by all workers and instances; the in-process
+# cache above stays in front of it and takes over if Redis is unreachable
+REDIS_URL = os.getenv('REDIS_URL')
+redis_client = None
+if REDIS_URL:
+    redis_client = aioredis.Redis(connection_pool=aioredis.ConnectionPool.from_url(
+        REDIS_URL,
+        max_connections=32,
+        socket_timeout=0.5,
+        socket_connect_timeout=0.5
+    ))
+
+# Current hour, refreshed at most once a second
+_hour_cache = [0, float('-inf')]
+
+def current_hour_cached():
+    now = time.monotonic()
+    if now - _hour_cache[1] >= 1.0:
+        _hour_cache[:] = [datetime.now().hour, now]
+    return _hour_cache[0]
+
+def make_cache_key(mood, energy, available_time, goals, current_hour):
+    payload = orjson.dumps({
+        "mood": mood,
+        "energy": energy,
+        "available_time": available_time,
+        "goals": sorted(goals),
+        "current_hour": current_hour
+    }, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+async def get_cached_plan(cache_key):
+    cached_plan = plan_cache.get(cache_key)
+    if cached_plan is not None or redis_client is None:
+        return cached_plan
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.get(f"plan:{cache_key}")
+        pipe.incr("plan:cache:lookups")
+        cached, _ = await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Redis unavailable, using local cache only: {str(e)}")
+        return None
+
+    if cached is None:
+        return None
+    cached_plan = orjson.loads(cached)
+    plan_cache[cache_key] = cached_plan
+    return cached_plan
+
+async def store_plan(cache_key, plan):
+    plan_cache[cache_key] = plan
+    if redis_client is None:
+        return
+
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        pipe.setex(f"plan:{cache_key}", PLAN_CACHE_TTL, orjson.dumps(plan))
+        pipe.incr("plan:cache:misses")
+        await pipe.execute()
+    except RedisError as e:
+        logger.warning(f"Redis unavailable, plan cached locally only: {str(e)}")
+
+def json_response(payload, status=200):
+    return Response(orjson.dumps(payload), status_code=status, media_type='application/json')
+
+async def health_check(request):
     try:
         logger.info("Health check requested")
-        return jsonify({
+        return json_response({
             "status": "healthy",
             "message": "Backend is running",
-            "timestamp": datetime.now().isoformat()
+            "timestamp": datetime.now()
         })
     except Exception as e:
         logger.error(f"Health check failed: {str(e)}")
-        return jsonify({"status": "error", "message": str(e)}), 500
-
-def format_time(hour, minute):
-    return f"{hour:02d}:{minute:02d}"
-
-def generate_time_slots(start_hour, duration_hours):
-    time_slots = []
-    current_hour = start_hour
-    current_minute = 0
-    
-    for _ in range(int(duration_hours)):
-        time_slots.append(format_time(current_hour, current_minute))
-        current_hour += 1
-        if current_hour >= 24:
-            current_hour = 0
-    
-    return time_slots
-
-def generate_plan(mood, energy, available_time, goals):
-    current_hour = datetime.now().hour
-    
-    prompt = f"""
-    Create a {available_time}-hour schedule for someone who is feeling {mood} with energy level {energy}/5.
-    They want to focus on: {', '.join(goals)}.
-    Start the schedule from {current_hour}:00.
-
-    Return a JSON array of activities. Each activity must have:
-    {{
-        "time": "HH:MM",
-        "activity": "Activity name",
-        "description": "Brief description",
-        "duration": minutes (integer),
-        "priority": 1 (high), 2 (medium), or 3 (low)
-    }}
-
-    Rules:
-    1. Use 24-hour time format (e.g., "14:00")
-    2. Keep activities between 30-60 minutes
-    3. Total duration must not exceed {int(available_time * 60)} minutes
-    4. Return only the JSON array, no other text
-    """
+        return json_response({"status": "error", "message": str(e)}, 500)
+
+# The invariant instructions are built once and always lead the prompt so
+# Gemini's implicit prefix cache can hit; only the short user line varies.
+PROMPT_PREFIX = """You are a planning assistant. Create a schedule for each user described below.
+Each schedule is a JSON array of activities. Each activity must have:
+{
+    "time": "HH:MM",
+    "activity": "Activity name",
+    "description": "Brief description",
+    "duration": minutes (integer),
+    "priority": 1 (high), 2 (medium), or 3 (low)
+}
+
+Rules:
+1. Use 24-hour time format (e.g., "14:00")
+2. Keep activities between 30-60 minutes
+3. Total duration must not exceed the user's available hours
+4. Start the schedule at the user's start time
+5. Return only JSON, no other text
+
+Each user is given as: mood; energy level from 1 to 5; available hours; start time; goals to focus on.
+"""
+PROMPT_SUFFIX = "\nReturn only the JSON array."
+BATCH_PROMPT_SUFFIX = "\nReturn only a JSON array of arrays: the N-th inner array is the schedule for user N, in the order listed."
+
+# Requests arriving within BATCH_WINDOW of each other share one Gemini call
+MAX_BATCH = int(os.getenv('MAX_BATCH', '8'))
+BATCH_WINDOW = float(os.getenv('BATCH_WINDOW_MS', '50')) / 1000
+plan_queue = asyncio.Queue()
+pending_batches = set()
+
+@lru_cache(maxsize=256)
+def join_goals(goals):
+    return ','.join(goals)
+
+def describe_request(mood, energy, available_time, goals, current_hour):
+    return f"mood={mood}; energy={energy}; hours={available_time}; start={current_hour:02d}:00; goals={join_goals(tuple(sorted(goals)))}"
+
+def build_prompt(params):
+    return PROMPT_PREFIX + "User: " + describe_request(*params) + PROMPT_SUFFIX
+
+def build_batch_prompt(batch_params):
+    users = "\n".join(
+        f"User {i}: {describe_request(*params)}"
+        for i, params in enumerate(batch_params, start=1)
+    )
+    return PROMPT_PREFIX + users + BATCH_PROMPT_SUFFIX
+
+# Outermost JSON array in the model output: first '[' through last ']'
+JSON_ARRAY_RE = re.compile(rb'\[.*\]', re.DOTALL)
+
+def parse_json_array(response_text):
+    if not response_text:
+        logger.error("Empty response from AI model")
+        raise ValueError("No response from AI model")
+
+    logger.info(f"AI Response: {response_text}")
+
+    # Extract the JSON array, skipping any prose or code fences around it
+    match = JSON_ARRAY_RE.search(response_text.encode())
+    if not match:
+        logger.error("No JSON array found in AI response")
+        raise ValueError("Invalid plan format received from AI")
 
     try:
-        logger.info(f"Generating plan with parameters: mood={mood}, energy={energy}, time={available_time}h, goals={goals}")
-        response = model.generate_content(prompt)
-        
-        if not response.text:
-            logger.error("Empty response from AI model")
-            raise ValueError("No response from AI model")
-
-        # Clean the response text to ensure it's valid JSON
-        cleaned_text = response.text.strip()
-        if not cleaned_text.startswith('['):
-            cleaned_text = cleaned_text[cleaned_text.find('['):]
-        if not cleaned_text.endswith(']'):
-            cleaned_text = cleaned_text[:cleaned_text.rfind(']')+1]
-
-        logger.info(f"AI Response: {cleaned_text}")
-        
-        try:
-            plan_data = json.loads(cleaned_text)
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing error: {str(e)}")
-            logger.error(f"Attempted to parse: {cleaned_text}")
-            raise ValueError("Invalid plan format received from AI")
+        data = orjson.loads(match.group(0))
+    except orjson.JSONDecodeError as e:
+        logger.error(f"JSON parsing error: {str(e)}")
+        logger.error(f"Attempted to parse: {match.group(0)}")
+        raise ValueError("Invalid plan format received from AI")
 
-        if not isinstance(plan_data, list):
-            raise ValueError("AI response is not a list of activities")
+    if not isinstance(data, list):
+        raise ValueError("AI response is not a list of activities")
+    return data
 
-        validated_plan = []
-        total_duration = 0
-        current_time = current_hour * 60  # Convert to minutes
+REQUIRED_FIELDS = frozenset(('time', 'activity', 'description', 'duration', 'priority'))
 
-        for item in plan_data:
-            try:
-                # Validate required fields
-                if not all(key in item for key in ['time', 'activity', 'description', 'duration', 'priority']):
-                    continue
+def validate_activity(item, current_time):
+    """Validate one activity in place; returns the next start time, or None to drop it."""
+    try:
+        # Validate required fields
+        if not REQUIRED_FIELDS <= item.keys():
+            return None
 
-                # Parse and validate duration
-                duration = int(item['duration'])
-                if duration < 30 or duration > 120:
-                    continue
+        # Parse and validate duration
+        duration = int(item['duration'])
+        if not 30 <= duration <= 120:
+            return None
 
-                # Update time based on current_time
-                hours = current_time // 60
-                minutes = current_time % 60
-                item['time'] = f"{hours:02d}:{minutes:02d}"
+        # Update time based on current_time
+        hours, minutes = divmod(current_time, 60)
+        item['time'] = f"{hours:02d}:{minutes:02d}"
 
-                # Validate priority
-                item['priority'] = max(1, min(3, int(item['priority'])))
+        # Validate priority
+        item['priority'] = max(1, min(3, int(item['priority'])))
 
-                validated_plan.append(item)
-                total_duration += duration
-                current_time += duration
+        return current_time + duration
 
-            except (ValueError, TypeError) as e:
-                logger.error(f"Error validating item {item}: {str(e)}")
-                continue
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Error validating item {item}: {str(e)}")
+        return None
 
-        if not validated_plan:
-            raise ValueError("No valid activities could be created")
+def validate_plan(plan_data, current_hour):
+    validated_plan = []
+    current_time = current_hour * 60  # Convert to minutes
+
+    for item in plan_data:
+        next_time = validate_activity(item, current_time)
+        if next_time is not None:
+            validated_plan.append(item)
+            current_time = next_time
+
+    if not validated_plan:
+        raise ValueError("No valid activities could be created")
+    return validated_plan
+
+async def run_single(params, future):
+    try:
+        validated_plan = await stream_plan(build_prompt(params), params[-1])
+    except Exception as e:
+        if not future.done():
+            future.set_exception(e)
+    else:
+        if not future.done():
+            future.set_result(validated_plan)
+
+async def run_batch(batch):
+    if len(batch) == 1:
+        await run_single(*batch[0])
+        return
+
+    try:
+        logger.info(f"Sending batched prompt for {len(batch)} requests")
+        plans = parse_json_array(await generate_content(build_batch_prompt([params for params, _ in batch])))
+        if len(plans) != len(batch) or not all(isinstance(plan, list) for plan in plans):
+            raise ValueError(f"Expected {len(batch)} schedules, got {len(plans)}")
+    except Exception as e:
+        logger.warning(f"Batched generation failed, falling back to single prompts: {str(e)}")
+        await asyncio.gather(*(run_single(params, future) for params, future in batch))
+        return
+
+    for (params, future), plan_data in zip(batch, plans):
+        if future.done():
+            continue
+        try:
+            future.set_result(validate_plan(plan_data, params[-1]))
+        except ValueError as e:
+            future.set_exception(e)
+
+async def batch_worker():
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await plan_queue.get()]
+        deadline = loop.time() + BATCH_WINDOW
+        while len(batch) < MAX_BATCH:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(plan_queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        # Dispatch without blocking collection of the next batch
+        task = asyncio.create_task(run_batch(batch))
+        pending_batches.add(task)
+        task.add_done_callback(pending_batches.discard)
+
+async def generate_plan(mood, energy, available_time, goals):
+    current_hour = current_hour_cached()
+
+    cache_key = make_cache_key(mood, energy, available_time, goals, current_hour)
+    cached_plan = await get_cached_plan(cache_key)
+    if cached_plan is not None:
+        logger.info("Returning cached plan")
+        return cached_plan
+
+    try:
+        logger.info(f"Generating plan with parameters: mood={mood}, energy={energy}, time={available_time}h, goals={goals}")
+        future = asyncio.get_running_loop().create_future()
+        await plan_queue.put(((mood, energy, available_time, goals, current_hour), future))
+        validated_plan = await future
 
         logger.info(f"Successfully generated plan with {len(validated_plan)} activities")
+        await store_plan(cache_key, validated_plan)
         return validated_plan
 
     except Exception as e:
         logger.error(f"Plan generation failed: {str(e)}")
         raise ValueError(f"Failed to generate plan: {str(e)}")
 
-@app.route('/api/generate-plan', methods=['POST'])
-def create_plan():
+class PlanRequest(BaseModel):
+    mood: str = Field(min_length=1)
+    energy: int = Field(default=3, ge=1, le=5)
+    available_time: float = Field(default=1.0, ge=0.5, le=24)
+    goals: List[str] = Field(min_length=1)
+
+    @field_validator('mood', 'goals', mode='after')
+    @classmethod
+    def lowercase(cls, value):
+        if isinstance(value, str):
+            return value.lower()
+        return [goal.lower() for goal in value]
+
+FIELD_ERRORS = {
+    'mood': 'Mood is required',
+    'goals': 'At least one goal is required',
+    'available_time': 'Available time must be between 0.5 and 24 hours',
+    'energy': 'Energy level must be between 1 and 5'
+}
+
+async def create_plan(request):
     try:
-        data = request.get_json()
-        mood = data.get('mood', '').lower()
-        energy = int(data.get('energy', 3))
-        available_time = float(data.get('available_time', 1))
-        goals = [g.lower() for g in data.get('goals', [])]
-
-        # Input validation
-        if not mood:
-            return jsonify({'error': 'Mood is required'}), 400
-        if not goals:
-            return jsonify({'error': 'At least one goal is required'}), 400
-        if available_time < 0.5 or available_time > 24:
-            return jsonify({'error': 'Available time must be between 0.5 and 24 hours'}), 400
-        if energy < 1 or energy > 5:
-            return jsonify({'error': 'Energy level must be between 1 and 5'}), 400
+        try:
+            plan_request = PlanRequest.model_validate_json(await request.body())
+        except ValidationError as e:
+            errors = e.errors(include_url=False, include_context=False, include_input=False)
+            field = errors[0]['loc'][0] if errors[0]['loc'] else None
+            return json_response({
+                'error': FIELD_ERRORS.get(field, 'Invalid request data'),
+                'details': errors
+            }, 400)
 
         try:
-            plan = generate_plan(mood, energy, available_time, goals)
-            return jsonify({'plan': plan})
+            plan = await generate_plan(
+                plan_request.mood,
+                plan_request.energy,
+                plan_request.available_time,
+                plan_request.goals
+            )
+            return json_response({'plan': plan})
         except ValueError as e:
-            return jsonify({'error': str(e)}), 400
+            return json_response({'error': str(e)}, 400)
         except Exception as e:
             logger.error(f"Unexpected error: {str(e)}")
-            return jsonify({'error': 'An unexpected error occurred'}), 500
+            return json_response({'error': 'An unexpected error occurred'}, 500)
 
     except Exception as e:
         logger.error(f"Request processing error: {str(e)}")
-        return jsonify({'error': 'Invalid request data'}), 400
+        return json_response({'error': 'Invalid request data'}, 400)
+
+app = Starlette(
+    routes=[
+        Route('/api/health', health_check, methods=['GET']),
+        Route('/api/generate-plan', create_plan, methods=['POST'])
+    ],
+    middleware=[
+        # Update CORS settings to allow requests from frontend
+        Middleware(
+            CORSMiddleware,
+            allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
+            allow_methods=["GET", "POST", "OPTIONS"],
+            allow_headers=["Content-Type", "Accept"]
+        )
+    ],
+    lifespan=lifespan,
+    debug=DEBUG
+)
 
 if __name__ == '__main__':
+    import uvicorn
+
     try:
-        logger.info("Starting Flask server...")
-        app.run(debug=True, port=5001, host='0.0.0.0')
+        # Development only; production runs under gunicorn (see gunicorn.conf.py)
+        logger.info("Starting Starlette server...")
+        uvicorn.run('app:app', port=5001, host='0.0.0.0', reload=DEBUG)
     except Exception as e:
         logger.error(f"Failed to start server: {str(e)}")
-        raise 
\ No newline at end of file
+        raise
@@ -0,0 +1,14 @@
+import multiprocessing
+import os
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Gunicorn settings for serving app:app; picked up automatically from this directory
+bind = os.getenv('BIND', '0.0.0.0:5001')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+# Async workers: each one multiplexes many in-flight Gemini calls on its event loop
+worker_class = 'uvicorn_worker.UvicornWorker'
+keepalive = 75
+timeout = 120
@@ -35,13 +35,13 @@ fi
 source venv/bin/activate || { echo "Error: Failed to activate virtual environment"; exit 1; }
 
 # Install requirements if needed
-if [ ! -f "venv/lib/python3.13/site-packages/flask" ]; then
+if [ ! -f "venv/lib/python3.13/site-packages/starlette" ]; then
     echo "Installing backend dependencies..."
     pip install -r requirements.txt || { echo "Error: Failed to install backend dependencies"; exit 1; }
 fi
 
 # Start backend server in background
-python3 app.py &
+gunicorn app:app &
 BACKEND_PID=$!
 
 # Wait for backend to start